@@ -1,34 +1,62 @@
 import streamlit as st
-import pandas as pd
 import docx
 from docx.shared import Cm, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
+from docx.opc import phys_pkg
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from lxml import etree
+from xml.sax.saxutils import escape as _xesc
 import secrets
 import string
-import io
+import tempfile
 import re
 import datetime
+import functools
+import gc
+import zipfile
 
 # --- CONFIGURATION ---
 DEFAULT_SHEET_URL = "https://docs.google.com/spreadsheets/d/1mYapaNzFhSdWTLWaK1cedvQVcjCgvr17EQ-SkEpwV24/edit?gid=0#gid=0"
 COUPON_VALUE = "₹10"
+COUPON_ROWS = 13
+COUPON_COLS = 5
+FAST_ZIP_SAVE = True  # Deflate at level 1 on save: faster, ~50% larger file
+
+# Shared font sizes, colours and row height for the coupon layout
+_PT6 = Pt(6)
+_PT7 = Pt(7)
+_PT9 = Pt(9)
+_PT10 = Pt(10)
+_PT12 = Pt(12)
+_GREEN = RGBColor(0, 100, 0)
+_CM_HEIGHT = Cm(1.9)
+
+# python-docx always saves at zlib's default level 6. The coupon XML is very
+# repetitive, so level 1 is much cheaper to compress for a modest size cost.
+# Reading is unaffected: compresslevel is ignored in "r" mode.
+if FAST_ZIP_SAVE:
+    phys_pkg.ZipFile = functools.partial(zipfile.ZipFile, compresslevel=1)
 
 # --- HELPER FUNCTIONS ---
 
+_SHEET_ID_RE = re.compile(r'/d/([a-zA-Z0-9_-]+)')
+_GID_RE = re.compile(r'[#&?]gid=([0-9]+)')
+
 def get_sheet_csv_url(original_url):
     """Extracts ID and GID (Tab ID) to create a CSV export link."""
     if not original_url:
         return None, "Empty URL"
     
     try:
-        sheet_id_match = re.search(r'/d/([a-zA-Z0-9-_]+)', original_url)
+        sheet_id_match = _SHEET_ID_RE.search(original_url)
         if not sheet_id_match:
             return None, "Could not find Sheet ID."
         sheet_id = sheet_id_match.group(1)
 
         gid = "0"
-        gid_match = re.search(r'[#&?]gid=([0-9]+)', original_url)
+        gid_match = _GID_RE.search(original_url)
         if gid_match:
             gid = gid_match.group(1)
             
@@ -36,20 +64,54 @@ def get_sheet_csv_url(original_url):
     except Exception:
         return None, "Invalid URL format."
 
-def generate_secure_code(prefix):
-    """Generates unique code: PREFIX-XXX-XXXX"""
-    alphabet = string.ascii_uppercase + string.digits
-    part1 = ''.join(secrets.choice(alphabet) for _ in range(3))
-    part2 = ''.join(secrets.choice(alphabet) for _ in range(4))
+@st.cache_data(ttl=300, show_spinner=False)
+def load_sheet(export_url):
+    """Downloads the sheet CSV; cached for 5 minutes per export URL."""
+    # pandas takes ~0.5 s to import, so defer it until a sheet is actually
+    # fetched instead of paying for it before the first page render
+    import pandas as pd
+    
+    df = pd.read_csv(export_url)
+    df.columns = [c.strip() for c in df.columns]
+    return df
+
+# Code alphabet as a byte translation table. Bytes >= 252 (7 * 36) are
+# dropped before mapping so every symbol stays equally likely.
+_CODE_ALPHABET = (string.ascii_uppercase + string.digits).encode()
+_CODE_LIMIT = 256 // len(_CODE_ALPHABET) * len(_CODE_ALPHABET)
+_CODE_TABLE = bytes(_CODE_ALPHABET[b % len(_CODE_ALPHABET)] for b in range(256))
+_CODE_REJECT = bytes(range(_CODE_LIMIT, 256))
+
+def generate_codes_batch(prefix, n):
+    """Generates n unique codes: PREFIX-XXX-XXXX, from a single RNG draw."""
+    needed = n * 7
+    # 8 bytes per code leaves headroom for the rejected bytes
+    chars = secrets.token_bytes(n * 8).translate(_CODE_TABLE, _CODE_REJECT)
+    while len(chars) < needed:
+        chars += secrets.token_bytes(8).translate(_CODE_TABLE, _CODE_REJECT)
+    chars = chars[:needed].decode('ascii')
     
     clean_prefix = str(prefix).upper().strip()
     
     # Check for invalid prefixes
     invalid_prefixes = ['NAN', 'NONE', '', 'nan']
-    if clean_prefix in invalid_prefixes:
-        return f"{part1}-{part2}"
-        
-    return f"{clean_prefix}-{part1}-{part2}"
+    head = "" if clean_prefix in invalid_prefixes else f"{clean_prefix}-"
+    
+    return [f"{head}{chars[i:i + 3]}-{chars[i + 3:i + 7]}" for i in range(0, needed, 7)]
+
+def generate_secure_code(prefix):
+    """Generates unique code: PREFIX-XXX-XXXX"""
+    return generate_codes_batch(prefix, 1)[0]
+
+def create_header_content(paragraph, name, date_label):
+    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # CHANGED: Now only Name and Date. No ID.
+    run_h = paragraph.add_run(f"{name}   {date_label}")
+    run_h.bold = True
+    run_h.font.size = _PT12
+    run_h.font.name = 'Arial'
+    paragraph.paragraph_format.space_after = _PT6
 
 def create_coupon_content(cell, name, emp_id, code, date_label):
     cell.vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
@@ -59,33 +121,32 @@ def create_coupon_content(cell, name, emp_id, code, date_label):
     p1.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run1 = p1.add_run(f"{COUPON_VALUE} Coupon")
     run1.bold = True
-    run1.font.size = Pt(9)
-    run1.font.color.rgb = RGBColor(0, 100, 0)
+    run1.font.size = _PT9
+    run1.font.color.rgb = _GREEN
     
     # 2. Unique Code
     p2 = cell.add_paragraph()
     p2.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run2 = p2.add_run(code)
     run2.font.name = 'Courier New'
-    run2.font.size = Pt(10)
+    run2.font.size = _PT10
     run2.bold = True
     
     # 3. Employee Info
     p3 = cell.add_paragraph()
     p3.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run3 = p3.add_run(f"{name}\n({emp_id})")
-    run3.font.size = Pt(7)
+    run3.font.size = _PT7
     
     # 4. Month/Year
     p4 = cell.add_paragraph()
     p4.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run4 = p4.add_run(date_label)
-    run4.font.size = Pt(6)
+    run4.font.size = _PT6
     run4.font.italic = True
 
-def generate_docx(df, selected_date, default_prefix_input):
-    doc = docx.Document()
-    
+def setup_page(doc):
+    """A4 portrait with 1 cm margins."""
     section = doc.sections[0]
     section.page_height = Cm(29.7)
     section.page_width = Cm(21.0)
@@ -94,69 +155,138 @@ def generate_docx(df, selected_date, default_prefix_input):
     section.left_margin = Cm(1.0)
     section.right_margin = Cm(1.0)
 
+_XMLNS_RE = re.compile(r' xmlns:\w+="[^"]*"')
+
+# python-docx turns tabs and line breaks in run text into <w:tab/> and <w:br/>
+_RUN_TEXT_ENTITIES = {
+    "\t": '</w:t><w:tab/><w:t xml:space="preserve">',
+    "\n": '</w:t><w:br/><w:t xml:space="preserve">',
+    "\r": '</w:t><w:br/><w:t xml:space="preserve">',
+}
+
+def xml_text(value):
+    """Escapes a value for a <w:t> placeholder, matching python-docx's run text."""
+    return _xesc(str(value), _RUN_TEXT_ENTITIES)
+
+@st.cache_resource(show_spinner=False)
+def build_coupon_templates():
+    """Captures the OOXML python-docx produces for one employee page.
+    
+    Returns (header, table_open, row_open, cell) strings. The header and
+    cell carry {name}, {emp_id}, {code} and {date} placeholders for
+    str.format_map, so a page can be assembled as text and parsed once
+    instead of being built cell by cell through python-docx. The layout is
+    fixed, so the capture runs once per server process and is shared
+    across sessions.
+    """
+    scratch = docx.Document()
+    setup_page(scratch)
+    header_p = scratch.add_paragraph()
+    create_header_content(header_p, "{name}", "{date}")
+    table = scratch.add_table(rows=1, cols=COUPON_COLS)
+    table.style = 'Table Grid'
+    table.rows[0].height = _CM_HEIGHT
+    
+    cell = table.cell(0, 0)
+    create_coupon_content(cell, "{name}", "{emp_id}", "{code}", "{date}")
+    # Placeholders hide any leading/trailing spaces of the real values
+    for t in scratch.element.body.iter(qn('w:t')):
+        t.set(qn('xml:space'), 'preserve')
+    
+    header_xml = etree.tostring(header_p._p, encoding='unicode')
+    
+    tbl = table._tbl
+    tr = tbl.tr_lst[0]
+    cell_xml = _XMLNS_RE.sub('', etree.tostring(cell._tc, encoding='unicode'))
+    
+    for tc in tr.tc_lst:
+        tr.remove(tc)
+    row_xml = _XMLNS_RE.sub('', etree.tostring(tr, encoding='unicode'))
+    
+    tbl.remove(tr)
+    table_xml = etree.tostring(tbl, encoding='unicode')
+    
+    return header_xml, table_xml[:-len('</w:tbl>')], row_xml[:-len('</w:tr>')], cell_xml
+
+def build_employee_xml(templates, name, emp_id, date_label, prefix):
+    """Returns the header <w:p> and <w:tbl> markup for one employee's page."""
+    header_xml, table_open, row_open, cell_xml = templates
+    codes = generate_codes_batch(prefix, COUPON_ROWS * COUPON_COLS)
+    fields = {"name": xml_text(name), "emp_id": xml_text(emp_id), "date": xml_text(date_label)}
+    
+    # Everything except the code is the same on all coupons, so fill it in
+    # once and only splice the code into each cell
+    cell_head, cell_tail = (part.format_map(fields) for part in cell_xml.split("{code}"))
+    
+    table_rows = []
+    for r in range(COUPON_ROWS):
+        row_codes = codes[r * COUPON_COLS:(r + 1) * COUPON_COLS]
+        cells = "".join(cell_head + xml_text(code) + cell_tail for code in row_codes)
+        table_rows.append(row_open + cells + "</w:tr>")
+    
+    return header_xml.format_map(fields), table_open + "".join(table_rows) + "</w:tbl>"
+
+def generate_docx(df, selected_date, default_prefix_input):
+    doc = docx.Document()
+    setup_page(doc)
+    templates = build_coupon_templates()
+
     # --- INTELLIGENT COLUMN DETECTION ---
     col_name = df.columns[0]
     col_id = df.columns[1]
     col_prefix = None
 
     for col in df.columns:
-        if "name" in col.lower():
+        lowered = col.lower()
+        if "name" in lowered:
             col_name = col
-        if "code" in col.lower() or "id" in col.lower():
+        if "code" in lowered or "id" in lowered:
             col_id = col
-        if "prefix" in col.lower():
+        if "prefix" in lowered:
             col_prefix = col
     
     st.info(f"Using columns: Name='{col_name}', ID='{col_id}', Prefix='{col_prefix if col_prefix else 'Using Default'}'")
 
+    # --- COLUMN VALUES AS TEXT ---
+    # fillna: pandas' string dtype keeps missing cells as NaN through astype(str)
+    names = df[col_name].astype(str).fillna('nan').tolist()
+    ids = df[col_id].astype(str).fillna('nan').tolist()
+    
+    # --- DETERMINE PREFIXES ---
+    if col_prefix:
+        prefixes = df[col_prefix].astype(str).fillna('nan')
+        has_prefix = prefixes.str.lower().ne('nan') & prefixes.str.strip().ne('')
+        prefixes = prefixes.where(has_prefix, default_prefix_input).tolist()
+    else:
+        prefixes = [default_prefix_input] * len(df)
+
     progress_bar = st.progress(0)
     total_rows = len(df)
+    # Each update is a websocket message; cap them at ~100 per run
+    progress_step = max(1, total_rows // 100)
 
-    for index, row in df.iterrows():
-        emp_name = str(row[col_name])
-        emp_id = str(row[col_id])
-        
-        # --- DETERMINE PREFIX ---
-        current_prefix = default_prefix_input
-        if col_prefix:
-            row_prefix = str(row[col_prefix])
-            if row_prefix.lower() != 'nan' and row_prefix.strip():
-                current_prefix = row_prefix
-
-        # --- HEADER (Top of Page) ---
-        header_p = doc.add_paragraph()
-        header_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        # CHANGED: Now only Name and Date. No ID.
-        run_h = header_p.add_run(f"{emp_name}   {selected_date}")
-        run_h.bold = True
-        run_h.font.size = Pt(12)
-        run_h.font.name = 'Arial'
-        header_p.paragraph_format.space_after = Pt(6)
-
-        # --- TABLE (Coupons) ---
-        table = doc.add_table(rows=13, cols=5)
-        table.style = 'Table Grid'
-        
-        for row_obj in table.rows:
-            row_obj.height = Cm(1.9) 
-            
-        for r in range(13):
-            for c in range(5):
-                cell = table.cell(r, c)
-                unique_code = generate_secure_code(current_prefix)
-                create_coupon_content(cell, emp_name, emp_id, unique_code, selected_date)
+    for index, (emp_name, emp_id, current_prefix) in enumerate(zip(names, ids, prefixes)):
+        # --- HEADER (Top of Page) + TABLE (Coupons) ---
+        header_xml, table_xml = build_employee_xml(templates, emp_name, emp_id, selected_date, current_prefix)
+        doc.element.body._insert_p(parse_xml(header_xml))
+        doc.element.body._insert_tbl(parse_xml(table_xml))
         
         # New Page for next employee
         if index < len(df) - 1:
             doc.add_page_break()
         
-        progress_bar.progress((index + 1) / total_rows)
+        if (index + 1) % progress_step == 0 or index == total_rows - 1:
+            progress_bar.progress((index + 1) / total_rows)
 
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    # Large outputs spill to disk instead of sitting in RAM next to the XML tree
+    with tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024) as buffer:
+        doc.save(buffer)
+        # python-docx parts and package reference each other, so the XML tree
+        # is only released by the cycle collector; run it before reading back
+        del doc
+        gc.collect()
+        buffer.seek(0)
+        return buffer.read()
 
 # --- MAIN APP UI ---
 st.set_page_config(page_title="Coupon Generator", page_icon="🎫")
@@ -210,8 +340,7 @@ if check_password():
                     st.error(f"Error: {err}")
                     st.stop()
                 
-                df = pd.read_csv(link)
-                df.columns = [c.strip() for c in df.columns]
+                df = load_sheet(link)
                 st.write(f"✅ Loaded {len(df)} Employees.")
 
                 # 2. Generate